@@ -13,7 +13,7 @@
 import numpy as np
 import xarray as xr
 from napari.qt.threading import thread_worker
-from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtCore import QTimer, pyqtSignal
 from qtpy.QtWidgets import QMessageBox, QWidget
 from skimage import morphology
 from skimage.measure import label
@@ -48,6 +48,9 @@ class PipelineButtonsWidget(QWidget):
 
     t_slider_changed = pyqtSignal()
 
+    # minimum time (ms) between re-segmentations while the threshold is being dragged
+    T_SLIDER_THROTTLE_MS = 30
+
     def __init__(self, *args, **kwargs):
         super(PipelineButtonsWidget, self).__init__(*args, **kwargs)
 
@@ -57,18 +60,30 @@ def __init__(self, *args, **kwargs):
         self.ui.thresholdSlider.setMinimum(np.iinfo(np.uint16).min)
         self.ui.thresholdSlider.setMaximum(np.iinfo(np.uint16).max)
 
+        # Dragging the slider fires valueChanged for every pixel of mouse movement,
+        # and each emission re-segments the whole stack. Coalesce those into at most
+        # one `t_slider_changed` per interval; the receiver reads the latest value.
+        self._t_slider_timer = QTimer(self)
+        self._t_slider_timer.setSingleShot(True)
+        self._t_slider_timer.setInterval(self.T_SLIDER_THROTTLE_MS)
+        self._t_slider_timer.timeout.connect(self.t_slider_changed.emit)
+
         self.ui.thresholdSlider.valueChanged.connect(self.handle_t_slider_changed)
         self.ui.thresholdSpinBox.valueChanged.connect(
             self.handle_threshold_spin_box_changed
         )
 
+    def _schedule_t_slider_changed(self):
+        if not self._t_slider_timer.isActive():
+            self._t_slider_timer.start()
+
     def handle_t_slider_changed(self):
         self.ui.thresholdSpinBox.setValue(self.ui.thresholdSlider.value())
-        self.t_slider_changed.emit()
+        self._schedule_t_slider_changed()
 
     def handle_threshold_spin_box_changed(self):
         self.ui.thresholdSlider.setValue(self.ui.thresholdSpinBox.value())
-        self.t_slider_changed.emit()
+        self._schedule_t_slider_changed()
 
 
 class App:
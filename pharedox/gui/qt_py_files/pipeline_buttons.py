@@ -20,18 +20,15 @@ def setupUi(self, Form):
         self.verticalLayout.setObjectName("verticalLayout")
         self.groupBox = QtWidgets.QGroupBox(Form)
         self.groupBox.setObjectName("groupBox")
-        self.verticalLayout_2 = QtWidgets.QVBoxLayout(self.groupBox)
-        self.verticalLayout_2.setObjectName("verticalLayout_2")
-        self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
-        self.horizontalLayout_2.setObjectName("horizontalLayout_2")
+        self.gridLayout = QtWidgets.QGridLayout(self.groupBox)
+        self.gridLayout.setObjectName("gridLayout")
         self.thresholdSlider = QtWidgets.QSlider(self.groupBox)
         self.thresholdSlider.setOrientation(QtCore.Qt.Horizontal)
         self.thresholdSlider.setObjectName("thresholdSlider")
-        self.horizontalLayout_2.addWidget(self.thresholdSlider)
+        self.gridLayout.addWidget(self.thresholdSlider, 0, 0, 1, 1)
         self.label = QtWidgets.QLabel(self.groupBox)
         self.label.setObjectName("label")
-        self.horizontalLayout_2.addWidget(self.label)
-        self.verticalLayout_2.addLayout(self.horizontalLayout_2)
+        self.gridLayout.addWidget(self.label, 0, 1, 1, 1)
         self.thresholdSpinBox = QtWidgets.QSpinBox(self.groupBox)
         sizePolicy = QtWidgets.QSizePolicy(
             QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Fixed
@@ -43,26 +40,22 @@ def setupUi(self, Form):
         )
         self.thresholdSpinBox.setSizePolicy(sizePolicy)
         self.thresholdSpinBox.setMinimumSize(QtCore.QSize(150, 0))
-        self.thresholdSpinBox.setMaximumSize(QtCore.QSize(16777215, 16777215))
         self.thresholdSpinBox.setAlignment(
             QtCore.Qt.AlignRight | QtCore.Qt.AlignTrailing | QtCore.Qt.AlignVCenter
         )
         self.thresholdSpinBox.setMaximum(65535)
         self.thresholdSpinBox.setSingleStep(100)
         self.thresholdSpinBox.setObjectName("thresholdSpinBox")
-        self.verticalLayout_2.addWidget(self.thresholdSpinBox)
-        self.horizontalLayout = QtWidgets.QHBoxLayout()
-        self.horizontalLayout.setObjectName("horizontalLayout")
+        self.gridLayout.addWidget(self.thresholdSpinBox, 1, 0, 1, 2)
         self.removeObjectsButton = QtWidgets.QPushButton(self.groupBox)
         self.removeObjectsButton.setObjectName("removeObjectsButton")
-        self.horizontalLayout.addWidget(self.removeObjectsButton)
+        self.gridLayout.addWidget(self.removeObjectsButton, 2, 0, 1, 1)
         self.smallObjectSizeSpinBox = QtWidgets.QSpinBox(self.groupBox)
         self.smallObjectSizeSpinBox.setMinimum(1)
         self.smallObjectSizeSpinBox.setMaximum(10000)
         self.smallObjectSizeSpinBox.setProperty("value", 5)
         self.smallObjectSizeSpinBox.setObjectName("smallObjectSizeSpinBox")
-        self.horizontalLayout.addWidget(self.smallObjectSizeSpinBox)
-        self.verticalLayout_2.addLayout(self.horizontalLayout)
+        self.gridLayout.addWidget(self.smallObjectSizeSpinBox, 2, 1, 1, 1)
         self.verticalLayout.addWidget(self.groupBox)
         spacerItem = QtWidgets.QSpacerItem(
             20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding
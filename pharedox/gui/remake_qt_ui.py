@@ -1,18 +1,25 @@
 import os
 from pathlib import Path
 
+import pyqt5ac
 
-def remake_qt_ui():
+
+def remake_qt_ui(force=True):
     ui_file_dir = Path(
         os.path.join(os.path.dirname(__file__), "qt_ui_files/")
     ).resolve()
     ui_py_file_dir = Path(
         os.path.join(os.path.dirname(__file__), "qt_py_files/")
     ).resolve()
-    for ui_file in ui_file_dir.iterdir():
-        os.system(
-            f"pyuic5 {ui_file.absolute()} -o {ui_py_file_dir.joinpath(ui_file.stem)}.py"
-        )
+    pyqt5ac.main(
+        ioPaths=[
+            [
+                str(ui_file_dir.joinpath("*.ui")),
+                str(ui_py_file_dir.joinpath("%%FILENAME%%.py")),
+            ]
+        ],
+        force=force,
+    )
 
 
 if __name__ == "__main__":
@@ -1,10 +1,10 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Union
 
-import matplotlib as mpl
 import matplotlib.pyplot as plt
 import numpy as np
-import numpy.ma as ma
 import pandas as pd
 import SimpleITK as sITK
 import xarray as xr
@@ -93,10 +93,13 @@ def subtract_medians(
 
     if image_data is None:
         image_data = data
+    elif "wavelength" in data.dims and "wavelength" in image_data.dims:
+        # only calculate medians for the wavelengths we will subtract them from (i.e.
+        # skip TL, derived wavelengths, etc.)
+        wvls = [w for w in image_data.wavelength.values if w in data.wavelength.values]
+        image_data = image_data.sel(wavelength=wvls)
 
-    submed = data.copy()
-    submed.values = np.maximum(data - image_data.median(dim=["x", "y"]), 0)
-    return submed
+    return data.copy(data=np.maximum(data - image_data.median(dim=["x", "y"]), 0).data)
 
 
 def get_lr_bounds(
@@ -122,16 +125,27 @@ def get_lr_bounds(
         An (m, 2) array where m = number of animals, the first column is the left bound
         and the second column is the right bound
     """
-    imgs = rot_seg_stack.sel(wavelength=ref_wvl, pair=ref_pair)
-    bounds = np.zeros((imgs.animal.size, 2))  # (animal, (l, r))
-    for i, img in enumerate(imgs):
-        _, l, _, r = measure.regionprops(measure.label(img))[0].bbox
-        bounds[i, :] = [l - pad, r + pad - 1]
-    return bounds.astype(np.int)
+    imgs = rot_seg_stack.sel(wavelength=ref_wvl, pair=ref_pair).transpose(
+        "animal", "y", "x"
+    )
+    # the bounds are those of the first object in each mask (as with regionprops),
+    # i.e. the first/last column containing any of it
+    labels, first_labels = _label_first_objects(imgs.data)
+    objects = labels == first_labels[:, np.newaxis, np.newaxis]
+    cols = objects.any(axis=1)  # (animal, x)
+
+    empty = ~cols.any(axis=1)
+    if np.any(empty):
+        idxs = np.flatnonzero(empty).tolist()
+        raise ValueError(f"No binary objects found in image(s) @ [idx={idxs}]")
+
+    l = cols.argmax(axis=1)
+    r = cols.shape[1] - cols[:, ::-1].argmax(axis=1)
+    return np.stack([l - pad, r + pad - 1], axis=1).astype(np.int64)
 
 
 def center_and_rotate_pharynxes(
-    fl_images: xr.DataArray, seg_images: xr.DataArray
+    fl_images: xr.DataArray, seg_images: xr.DataArray, n_workers: int = None
 ) -> (xr.DataArray, xr.DataArray):
     """
     Given a fluorescence stack and a pharyngeal mask stack, center and rotate each frame
@@ -144,6 +158,9 @@ def center_and_rotate_pharynxes(
         The fluorescence images to rotate and align
     seg_images
         The segmented images to rotate and align
+    n_workers
+        The number of threads with which to process the animals in parallel. Defaults
+        to the `concurrent.futures.ThreadPoolExecutor` default
 
     Returns
     -------
@@ -156,70 +173,89 @@ def center_and_rotate_pharynxes(
         fl_images.x.size // 2,
     )
 
-    fl_rotated_stack = fl_images.copy()
-    seg_rotated_stack = seg_images.copy()
-
-    # STACK_ITERATION
-    for img_idx in range(fl_images.animal.size):
-        for wvl in fl_images.wavelength.data:
-            for pair in fl_images.pair.data:
-                for tp in fl_images.timepoint.values:
-                    # Optimization potential here...
-                    # this recalculates all region properties for the reference each time
-                    img = fl_images.isel(animal=img_idx).sel(
-                        wavelength=wvl, pair=pair, timepoint=tp
-                    )
-
-                    try:
-                        # Old data, had wavelength attached
-                        ref_seg = seg_images.isel(animal=img_idx, wavelength=0).sel(
-                            pair=pair, timepoint=tp
-                        )
-                    except ValueError:
-                        ref_seg = seg_images.isel(animal=img_idx).sel(
-                            pair=pair, timepoint=tp
-                        )
-
-                    try:
-                        props = measure.regionprops(measure.label(ref_seg))[0]
-                    except IndexError:
-                        raise ValueError(
-                            f"No binary objects found in image @ [idx={img_idx} ; wvl={wvl} ; pair={pair}]"
-                        )
-
-                    # pharynx_center_y, pharynx_center_x = props.centroid
-                    pharynx_center_y, pharynx_center_x = np.mean(
-                        np.nonzero(ref_seg), axis=1
+    # every pixel of the output stacks is overwritten below, so rather than copying the
+    # input data, just allocate (uninitialized) arrays of the same shape and dtype
+    fl_rotated_stack = fl_images.copy(data=np.empty_like(fl_images.data))
+    seg_rotated_stack = seg_images.copy(data=np.empty_like(seg_images.data))
+
+    # Read and write the frames positionally, straight from/into the underlying arrays,
+    # rather than through (chained) xarray label indexing. Look up where each
+    # pair/timepoint is in the masks once, in case they are ordered differently
+    seg_pair_idxs = {p: i for i, p in enumerate(seg_images.pair.values)}
+    seg_tp_idxs = {tp: i for i, tp in enumerate(seg_images.timepoint.values)}
+
+    def frame_index(dims, **positions):
+        # dims not given are taken whole (i.e. y/x, and the wavelength of old masks)
+        return tuple(positions.get(dim, slice(None)) for dim in dims)
+
+    # The animals are independent (and write to disjoint parts of the output stacks),
+    # and the heavy lifting releases the GIL, so rotate them in parallel threads
+    def center_and_rotate_animal(img_idx):
+        for pair_idx, pair in enumerate(fl_images.pair.values):
+            for tp_idx, tp in enumerate(fl_images.timepoint.values):
+                # the reference mask (and so the transformation) only depends on the
+                # animal/pair/timepoint, so calculate it once for all wavelengths
+                seg_idx = frame_index(
+                    seg_images.dims,
+                    animal=img_idx,
+                    pair=seg_pair_idxs[pair],
+                    timepoint=seg_tp_idxs[tp],
+                )
+                ref_seg = seg_images.data[seg_idx]
+                if ref_seg.ndim == 3:
+                    # Old data, had wavelength attached
+                    ref_seg = ref_seg[0]
+
+                try:
+                    props = measure.regionprops(measure.label(ref_seg))[0]
+                except IndexError:
+                    raise ValueError(
+                        f"No binary objects found in image @ [idx={img_idx} ; pair={pair} ; timepoint={tp}]"
                     )
-                    pharynx_orientation = props.orientation
 
-                    translation_matrix = transform.EuclideanTransform(
-                        translation=(
-                            -(img_center_x - pharynx_center_x),
-                            -(img_center_y - pharynx_center_y),
-                        )
+                # pharynx_center_y, pharynx_center_x = props.centroid
+                # (the mean of the foreground pixel coordinates, calculated from the row
+                # and column projections so the coordinates needn't be materialized)
+                fg = ref_seg != 0
+                row_counts, col_counts = fg.sum(axis=1), fg.sum(axis=0)
+                n_fg = row_counts.sum()
+                pharynx_center_y = (row_counts @ np.arange(fg.shape[0])) / n_fg
+                pharynx_center_x = (col_counts @ np.arange(fg.shape[1])) / n_fg
+                pharynx_orientation = props.orientation
+
+                translation_matrix = transform.EuclideanTransform(
+                    translation=(
+                        -(img_center_x - pharynx_center_x),
+                        -(img_center_y - pharynx_center_y),
                     )
+                )
 
-                    rotated_img = rotate(
-                        img.data, translation_matrix, pharynx_orientation
+                rotated_seg = rotate(
+                    ref_seg,
+                    translation_matrix,
+                    pharynx_orientation,
+                    order=0,
+                    preserve_range=True,
+                )
+                seg_rotated_stack.data[seg_idx] = rotated_seg
+
+                for wvl_idx in range(fl_images.wavelength.size):
+                    fl_idx = frame_index(
+                        fl_images.dims,
+                        animal=img_idx,
+                        pair=pair_idx,
+                        timepoint=tp_idx,
+                        wavelength=wvl_idx,
                     )
-                    rotated_seg = rotate(
-                        ref_seg.data,
-                        translation_matrix,
-                        pharynx_orientation,
-                        order=0,
-                        preserve_range=True,
+                    fl_rotated_stack.data[fl_idx] = rotate(
+                        fl_images.data[fl_idx], translation_matrix, pharynx_orientation
                     )
 
-                    fl_rotated_stack.loc[dict(wavelength=wvl, pair=pair, timepoint=tp)][
-                        img_idx
-                    ] = rotated_img
-
-                    seg_rotated_stack.loc[dict(pair=pair, timepoint=tp)][
-                        img_idx
-                    ] = rotated_seg
+    # STACK_ITERATION
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        # consume the results so that any exceptions are raised here
+        list(executor.map(center_and_rotate_animal, range(fl_images.animal.size)))
 
-    fl_rotated_stack.values = fl_rotated_stack.values.astype(fl_images.dtype)
     return fl_rotated_stack, seg_rotated_stack
 
 
@@ -241,11 +277,17 @@ def extract_largest_binary_object(
 
     """
     labels = measure.label(bin_img)
-    if labels.max() == 0:
+    counts = np.bincount(labels.ravel())
+    if counts.size == 1:
         # If there are no objects in the image... simply return the image
         return bin_img
 
-    return labels == np.argmax(np.bincount(labels.flat)[1:]) + 1
+    # look the mask up in a per-label table rather than comparing the whole label
+    # image against the largest label
+    counts[0] = 0
+    lut = np.zeros(counts.size, dtype=bool)
+    lut[counts.argmax()] = True
+    return lut[labels]
 
 
 def get_area_of_largest_object(mask: np.ndarray) -> int:
@@ -261,21 +303,69 @@ def get_area_of_largest_object(mask: np.ndarray) -> int:
     int
         the area of the largest object 
     """
-    try:
-        return measure.regionprops(measure.label(mask))[0].area
-    except IndexError:
-        return 0
+    return int(_first_object_areas(np.asarray(mask)[np.newaxis])[0])
 
 
-def segment_pharynx(
-    fl_img: xr.DataArray, target_area: int = 450, area_range: int = 100
-) -> xr.DataArray:
-    """Generate a mask for the given image containing a pharynx.
+def _first_object_areas(masks: np.ndarray) -> np.ndarray:
+    """
+    Label a stack of binary images in a single pass and return, for each frame, the
+    area (px) of its first labelled object (0 if the frame is empty). This is the
+    batched equivalent of calling `get_area_of_largest_object` on every frame.
 
     Parameters
     ----------
-    fl_img : xr.DataArray
-        a fluorescent image containing a single pharynx 
+    masks : np.ndarray
+        a stack of binary images with shape (frame, row, col)
+
+    Returns
+    -------
+    np.ndarray
+        the areas, with shape (frame,)
+    """
+    labels, first_labels = _label_first_objects(masks)
+    # (the "first label" of empty frames is past the last label, so has no pixels)
+    areas = np.bincount(labels.ravel(), minlength=first_labels.max(initial=0) + 1)
+    areas[0] = 0
+    return areas[first_labels]
+
+
+def _label_first_objects(masks: np.ndarray) -> (np.ndarray, np.ndarray):
+    """
+    Label a stack of binary images (frame, row, col) in a single pass, with full
+    connectivity within each frame (as in `measure.label`) and none across frames.
+
+    Returns the labels, and the label of each frame's first object (i.e. the object
+    `measure.regionprops(measure.label(frame))[0]` describes). Empty frames get a
+    label greater than any in the stack.
+    """
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = True
+    labels, n_labels = ndi.label(masks, structure=structure)
+
+    # labels are assigned in raster order and no object spans frames, so each frame's
+    # labels carry on from the previous frames', and its first object is the one
+    # labelled right after the largest label in any previous frame
+    frame_max_labels = labels.max(axis=(1, 2))
+    prev_max_labels = np.maximum.accumulate(
+        np.concatenate([[0], frame_max_labels[:-1]])
+    )
+    first_labels = np.where(frame_max_labels > 0, prev_max_labels + 1, n_labels + 1)
+    return labels, first_labels
+
+
+def _segment_pharynx_stack(
+    fl_imgs: np.ndarray, target_area: int = 450, area_range: int = 100
+) -> np.ndarray:
+    """
+    Run the threshold search of `segment_pharynx` on every frame of a stack at once.
+
+    Each step of the search labels all frames that haven't converged yet in a single
+    call, instead of looping over frames in python.
+
+    Parameters
+    ----------
+    fl_imgs : np.ndarray
+        fluorescent images with shape (frame, row, col), each containing one pharynx
     target_area : int, optional
         the presumptive area (in px) of a pharynx, by default 450
     area_range : int, optional
@@ -283,49 +373,85 @@ def segment_pharynx(
 
     Returns
     -------
-    xr.DataArray
-        an image containing the segmented pharynx (dtype: np.uint8). Pixels of value=1
-        indicate the pharynx, pixels of value=0 indicate the background.
+    np.ndarray
+        the masks (dtype: np.uint8), with the same shape as `fl_imgs`
     """
-    # target_area = 450  # experimentally derived
-    # area_range = 100
     min_area = target_area - area_range
     max_area = target_area + area_range
 
     max_iter = 300
 
-    p = 0.15
-    t = fl_img.max() * p
-    mask = fl_img > t
+    maxes = fl_imgs.max(axis=(1, 2))[:, np.newaxis, np.newaxis]
+    p = np.full(len(fl_imgs), 0.15)
+
+    masks = fl_imgs > (maxes * p[:, np.newaxis, np.newaxis])
+    out = masks.astype(np.uint8)
+    converged = np.zeros(len(fl_imgs), dtype=bool)
 
-    area = get_area_of_largest_object(mask)
+    # frames that are still being searched
+    active = np.arange(len(fl_imgs))
+    area = _first_object_areas(masks)
 
     i = 0
-    while (min_area > area) or (area > max_area):
-        if i >= max_iter:
-            return mask
-        area = get_area_of_largest_object(mask)
-
-        logging.debug(f"Setting p={p}")
-        if area > max_area:
-            p = p + 0.01
-        if area < min_area:
-            p = p - 0.01
+    while active.size > 0:
+        in_range = (min_area <= area) & (area <= max_area)
+        converged[active[in_range]] = True
+        active, area = active[~in_range], area[~in_range]
+        if active.size == 0:
+            break
+
+        logging.debug(f"Adjusting threshold for {active.size} frames")
+        p[active[area > max_area]] += 0.01
+        p[active[area < min_area]] -= 0.01
         i = i + 1
 
-        t = fl_img.max() * p
-        mask = fl_img > t
+        masks = fl_imgs[active] > (maxes[active] * p[active, np.newaxis, np.newaxis])
+        out[active] = masks
 
-        if p < 0:
+        stuck = (p[active] < 0) | (p[active] > 0.9)
+        if np.any(stuck):
             # break out if loop gets stuck w/ sensible default
-            logging.warning("Caught infinite loop")
-            return fl_img > (fl_img.max() * 0.15)
-        if p > 0.9:
-            logging.warning("Caught infinite loop")
-            return fl_img > (fl_img.max() * 0.15)
+            logging.warning(f"Caught infinite loop in {np.sum(stuck)} frame(s)")
+            out[active[stuck]] = fl_imgs[active[stuck]] > (maxes[active[stuck]] * 0.15)
+            active, masks = active[~stuck], masks[~stuck]
+
+        if i >= max_iter:
+            break
+
+        area = _first_object_areas(masks)
 
-    mask = extract_largest_binary_object(mask).astype(np.uint8)
+    for idx in np.flatnonzero(converged):
+        out[idx] = extract_largest_binary_object(out[idx])
+
+    return out
+
+
+def segment_pharynx(
+    fl_img: xr.DataArray, target_area: int = 450, area_range: int = 100
+) -> xr.DataArray:
+    """Generate a mask for the given image containing a pharynx.
 
+    Parameters
+    ----------
+    fl_img : xr.DataArray
+        a fluorescent image containing a single pharynx 
+    target_area : int, optional
+        the presumptive area (in px) of a pharynx, by default 450
+    area_range : int, optional
+        the acceptable range (in px) above/below the target_area, by default 100
+
+    Returns
+    -------
+    xr.DataArray
+        an image containing the segmented pharynx (dtype: np.uint8). Pixels of value=1
+        indicate the pharynx, pixels of value=0 indicate the background.
+    """
+    mask = _segment_pharynx_stack(
+        np.asarray(fl_img)[np.newaxis], target_area=target_area, area_range=area_range
+    )[0]
+
+    if isinstance(fl_img, xr.DataArray):
+        return fl_img.copy(data=mask)
     return mask
 
 
@@ -354,16 +480,12 @@ def segment_pharynxes(
         the masks for the specified wavelength
     """
 
-    to_segment = fl_stack.sel(wavelength=wvl)
-    seg = xr.apply_ufunc(
-        segment_pharynx,
-        to_segment,
-        input_core_dims=[["y", "x"]],
-        output_core_dims=[["y", "x"]],
-        vectorize=True,
-        kwargs={"target_area": target_area, "area_range": area_range},
+    to_segment = fl_stack.sel(wavelength=wvl).transpose(..., "y", "x")
+    frames = to_segment.values.reshape((-1,) + to_segment.shape[-2:])
+    seg = _segment_pharynx_stack(
+        frames, target_area=target_area, area_range=area_range
     )
-    return seg
+    return to_segment.copy(data=seg.reshape(to_segment.shape))
 
 
 def rotate(
@@ -395,14 +517,18 @@ def rotate(
         the translated and rotated image
 
     """
+    # Compose the translation with the rotation (about the image center, as in
+    # `transform.rotate`) so the image is only interpolated once
+    rows, cols = img.shape[0], img.shape[1]
+    center = np.array((cols, rows)) / 2.0 - 0.5
+    rotation = (
+        transform.EuclideanTransform(translation=-center)
+        + transform.EuclideanTransform(rotation=np.pi / 2 - orientation)
+        + transform.EuclideanTransform(translation=center)
+    )
 
-    return transform.rotate(
-        transform.warp(
-            img, tform, preserve_range=preserve_range, mode="wrap", order=order
-        ),
-        np.degrees(np.pi / 2 - orientation),
-        mode="edge",
-        order=order,
+    return transform.warp(
+        img, rotation + tform, preserve_range=preserve_range, mode="edge", order=order
     )
 
 
@@ -427,13 +553,59 @@ def calculate_midlines(rot_seg_stack: xr.DataArray, degree: int = 4) -> xr.DataA
     --------
     calculate_midline
     """
-    return xr.apply_ufunc(
-        calculate_midline,
-        rot_seg_stack,
-        input_core_dims=[["y", "x"]],
-        vectorize=True,
-        keep_attrs=True,
-        kwargs={"degree": degree},
+    pad = 10  # the `calculate_midline` default
+
+    frames = rot_seg_stack.transpose(..., "y", "x")
+    masks = frames.data.reshape((-1,) + frames.shape[-2:])
+    n_frames, height, width = masks.shape
+    labels, first_labels = _label_first_objects(masks)
+    # (single precision keeps the sums below exact, and lets them use BLAS)
+    objects = (labels == first_labels[:, np.newaxis, np.newaxis]).astype(np.float32)
+
+    # Fit all of the frames at once, by solving the least-squares normal equations
+    # of each frame. Every column of a frame's object contributes its pixel count
+    # (weight) and the sum of its pixels' rows to those, so only the column
+    # projections of the objects are needed.
+    col_counts = objects.sum(axis=1)  # (frame, x)
+    col_row_sums = np.arange(height, dtype=np.float32) @ objects
+
+    # The domain of each midline is that of `calculate_midline`: from the first row
+    # (sic) to the last column of the object's bounding box, padded
+    rows = objects.any(axis=2)
+    cols = col_counts > 0
+    left_bounds = rows.argmax(axis=1) - pad
+    right_bounds = width - cols[:, ::-1].argmax(axis=1) + pad
+
+    # Like `Polynomial.fit`, fit in the window ([-1, 1]) the domain is mapped onto
+    scl = 2 / (right_bounds - left_bounds)
+    off = -1 - left_bounds * scl
+    us = off[:, np.newaxis] + scl[:, np.newaxis] * np.arange(width)
+    u_powers = np.ones(us.shape + (2 * degree + 1,))  # (frame, x, power)
+    u_powers[..., 1:] = us[..., np.newaxis]
+    u_powers = np.cumprod(u_powers, axis=-1)
+
+    moments = np.einsum("fx,fxk->fk", col_counts, u_powers)
+    powers = np.arange(degree + 1)
+    lhs = moments[:, powers[:, np.newaxis] + powers[np.newaxis, :]]
+    rhs = np.einsum("fx,fxk->fk", col_row_sums, u_powers[..., : degree + 1])
+
+    # Frames spanning fewer columns than there are coefficients don't determine the
+    # fit (and empty frames, e.g. TL, have no midline), so leave them to
+    # `calculate_midline`
+    solvable = cols.sum(axis=1) > degree
+    coefs = np.zeros((n_frames, degree + 1))
+    solved = np.linalg.solve(lhs[solvable], rhs[solvable, :, np.newaxis])
+    coefs[solvable] = solved[..., 0]
+
+    midlines = np.empty(n_frames, dtype=object)
+    for i in range(n_frames):
+        if solvable[i]:
+            midlines[i] = Polynomial(coefs[i], domain=[left_bounds[i], right_bounds[i]])
+        else:
+            midlines[i] = calculate_midline(masks[i], degree=degree, pad=pad)
+
+    return frames.isel(y=0, x=0, drop=True).copy(
+        data=midlines.reshape(frames.shape[:-2])
     )
 
 
@@ -481,6 +653,18 @@ def calculate_midline(
             return None
 
 
+@lru_cache(maxsize=32)
+def _normal_line_weights(n_line_pts: int, norm_scale: float) -> np.ndarray:
+    """
+    The weights used to average across the normal lines in `measure_under_midline`:
+    a normal distribution (see `scipy.stats.norm.pdf`) with the given scale, evaluated
+    at `n_line_pts` evenly-spaced points on [-1, 1].
+
+    Cached, since it is the same for every frame in a stack. Don't modify the result.
+    """
+    return norm.pdf(np.linspace(-1, 1, n_line_pts), scale=norm_scale)
+
+
 def measure_under_midline(
     fl: xr.DataArray,
     mid: Polynomial,
@@ -489,6 +673,8 @@ def measure_under_midline(
     order=1,
     norm_scale=1,
     flatten=True,
+    *,
+    coords_cache: dict = None,
 ) -> np.ndarray:
     """
     Measure the intensity profile of the given image under the given midline at the given x-coordinates.
@@ -507,6 +693,10 @@ def measure_under_midline(
         The number of points to measure under
     thickness
         The thickness of the line to measure under. 
+    coords_cache
+        if given, a dict in which the sampling coordinates are memoized by
+        ``(id(mid), n_points, thickness)``, so repeated calls with the same midline
+        (e.g. one per wavelength) only evaluate it once. Only valid while the midlines it was filled with are alive.
     
     Notes
     -----
@@ -529,67 +719,31 @@ def measure_under_midline(
     """
     # Make sure the image orientation matches with the expected order of map_coordinates
     try:
-        if thickness == 0:
-            xs, ys = mid.linspace(n=n_points)
-            fl = np.asarray(fl)
-            return ndi.map_coordinates(fl, np.stack([xs, ys]), order=order)
+        # interpolate in single precision: integer images would otherwise truncate the
+        # interpolated values, and float64 just doubles the memory traffic
+        fl = np.ascontiguousarray(fl, dtype=np.float32)
+        # the spline prefilter is only needed (and only does anything) for order > 1
+        prefilter = order > 1
+        if coords_cache is None:
+            coords = _midline_sample_coords(mid, n_points, thickness)
         else:
-            # Gets a bit wonky, but makes sense
-
-            # We need to get the normal lines from each point in the midline
-            # then measure under those lines.
-
-            # First, get the coordinates of the midline
-            xs, ys = mid.linspace(n=n_points)
-
-            # Now, we get the angles of each normal vector
-            der = mid.deriv()
-            normal_slopes = -1 / der(xs)
-            normal_thetas = np.arctan(normal_slopes)
-
-            # We get the x and y components of the start/end of the normal vectors
-            mag = thickness / 2
-            x0 = np.cos(normal_thetas) * mag
-            y0 = np.sin(normal_thetas) * mag
-
-            x1 = np.cos(normal_thetas) * -mag
-            y1 = np.sin(normal_thetas) * -mag
-
-            # These are the actual coordinates of the starts/ends of the normal vectors as they move
-            # from (x,y) coordinates in the midline
-            xs0 = xs + x0
-            xs1 = xs + x1
-            ys0 = ys + y0
-            ys1 = ys + y1
-
-            # We need to measure in a consistent direction along the normal line
-            # if y0 < y1, we're going to be measuring in an opposite direction along the line... so we need flip the coordinates
-            for y0, y1, x0, x1, i in zip(ys0, ys1, xs0, xs1, range(len(xs0))):
-                if y0 < y1:
-                    tx = xs0[i]
-                    xs0[i] = xs1[i]
-                    xs1[i] = tx
-
-                    ty = ys0[i]
-                    ys0[i] = ys1[i]
-                    ys1[i] = ty
+            key = (id(mid), n_points, thickness)
+            if key not in coords_cache:
+                coords_cache[key] = _midline_sample_coords(mid, n_points, thickness)
+            coords = coords_cache[key]
 
-            n_line_pts = thickness
-
-            all_xs = np.linspace(xs0, xs1, n_line_pts)
-            all_ys = np.linspace(ys0, ys1, n_line_pts)
-
-            straightened = ndi.map_coordinates(fl, [all_xs, all_ys], order=order)
+        if thickness == 0:
+            return ndi.map_coordinates(fl, coords, order=order, prefilter=prefilter)
+        else:
+            straightened = ndi.map_coordinates(
+                fl, coords, order=order, prefilter=prefilter
+            )
 
             if flatten:
-                # Create a normal distribution centered around 0 with the given scale (see scipy.norm.pdf)
-                # the distribution is then tiled to be the same shape as the straightened pharynx
-                # then, this resultant matrix is the weights for averaging
-                w = np.tile(
-                    norm.pdf(np.linspace(-1, 1, n_line_pts), scale=norm_scale),
-                    (n_points, 1),
-                ).T
-                profile = np.average(straightened, axis=0, weights=w)
+                # Weight each point along the normal line by a normal distribution
+                # centered on the midline, then take the weighted average across the line
+                w = _normal_line_weights(coords.shape[1], norm_scale)
+                profile = (straightened * w[:, np.newaxis]).sum(axis=0) / w.sum()
 
                 return profile
             else:
@@ -602,7 +756,61 @@ def measure_under_midline(
         # Here, something actually went wrong
         logging.warning(f"measuring under midline failed with error {e}")
 
-    return np.zeros((1, n_points))
+    return np.zeros(n_points)
+
+
+def _midline_sample_coords(
+    mid: Polynomial, n_points: int, thickness: float
+) -> np.ndarray:
+    """
+    The (x, y) coordinates at which `measure_under_midline` samples the image: shape
+    (2, n_points) for a 0-thickness line, otherwise (2, thickness, n_points), i.e.
+    ``thickness`` points along the normal line at each point of the midline.
+    """
+    if thickness == 0:
+        xs, ys = mid.linspace(n=n_points)
+        return np.stack([xs, ys])
+    else:
+        # Gets a bit wonky, but makes sense
+
+        # We need to get the normal lines from each point in the midline
+        # then measure under those lines.
+
+        # First, get the coordinates of the midline
+        xs, ys = mid.linspace(n=n_points)
+
+        # Now, we get the angles of each normal vector
+        der = mid.deriv()
+        normal_slopes = -1 / der(xs)
+        normal_thetas = np.arctan(normal_slopes)
+
+        # We get the x and y components of the start/end of the normal vectors
+        mag = thickness / 2
+        x0 = np.cos(normal_thetas) * mag
+        y0 = np.sin(normal_thetas) * mag
+
+        x1 = np.cos(normal_thetas) * -mag
+        y1 = np.sin(normal_thetas) * -mag
+
+        # These are the actual coordinates of the starts/ends of the normal vectors as they move
+        # from (x,y) coordinates in the midline
+        xs0 = xs + x0
+        xs1 = xs + x1
+        ys0 = ys + y0
+        ys1 = ys + y1
+
+        # We need to measure in a consistent direction along the normal line
+        # if y0 < y1, we're going to be measuring in an opposite direction along the line... so we need flip the coordinates
+        flip = ys0 < ys1
+        xs0, xs1 = np.where(flip, xs1, xs0), np.where(flip, xs0, xs1)
+        ys0, ys1 = np.where(flip, ys1, ys0), np.where(flip, ys0, ys1)
+
+        n_line_pts = thickness
+
+        all_xs = np.linspace(xs0, xs1, n_line_pts)
+        all_ys = np.linspace(ys0, ys1, n_line_pts)
+
+        return np.stack([all_xs, all_ys])
 
 
 def measure_under_midlines(
@@ -632,20 +840,50 @@ def measure_under_midlines(
     profile_data: xr.DataArray
         the intensity profiles for each image in the stack
     """
-    measurements = xr.apply_ufunc(
-        measure_under_midline,
-        fl_stack,
-        midlines,
-        input_core_dims=[["x", "y"], []],
-        output_core_dims=[["position"]],
-        vectorize=True,
-        keep_attrs=True,
-        kwargs={
-            "n_points": n_points,
-            "thickness": thickness,
-            "order": order,
-            "flatten": True,
-        },
+    # Loop over the frames directly (rather than with `xr.apply_ufunc(vectorize=True)`)
+    # to skip the per-frame xarray dispatch. Each frame is measured in (x, y) order
+    frames = fl_stack.transpose(..., "x", "y")
+    frame_mids = midlines.broadcast_like(frames.isel(x=0, y=0, drop=True)).transpose(
+        *frames.dims[:-2]
+    )
+    # convert (and transpose) the whole stack at once, rather than once per frame in
+    # `measure_under_midline`
+    fl_data = np.ascontiguousarray(frames.data, dtype=np.float32).reshape(
+        (-1,) + frames.shape[-2:]
+    )
+    mid_data = frame_mids.data.ravel()
+
+    # the midlines are shared across wavelengths; only evaluate each once
+    coords_cache = {}
+    profiles = np.empty((len(fl_data), n_points), dtype=np.float32)
+    for i in range(len(fl_data)):
+        profile = measure_under_midline(
+            fl_data[i],
+            mid_data[i],
+            n_points=n_points,
+            thickness=thickness,
+            order=order,
+            flatten=True,
+            coords_cache=coords_cache,
+        )
+        # a frame that couldn't be measured gets a 0-profile (rather than NaNs)
+        profiles[i] = 0 if profile is None else profile
+
+    # merge the coordinates of both inputs as `xr.apply_ufunc` would, dropping those
+    # that conflict (e.g. the per-wavelength `frame` of the stack vs. the midlines')
+    coords = xr.merge(
+        [
+            frames.isel(x=0, y=0, drop=True).coords.to_dataset(),
+            midlines.coords.to_dataset(),
+        ],
+        compat="minimal",
+        join="exact",
+    ).coords
+    measurements = xr.DataArray(
+        profiles.reshape(frame_mids.shape + (n_points,)),
+        dims=frame_mids.dims + ("position",),
+        coords=coords,
+        attrs=fl_stack.attrs,
     )
 
     measurements = measurements.assign_coords(
@@ -701,25 +939,27 @@ def normalize_images_by_wvl_pair(
     xr.DataArray
         the normalized images
     """
-    idx_to_clip = int(profiles.shape[-1] * percent_to_clip / 100)
-    profiles = profiles[:, idx_to_clip:-idx_to_clip]
-
-    norm_fl = fl_imgs.copy().astype(np.float)
-    for pair in fl_imgs.pair:
-        for wvl in fl_imgs.wavelength.values:
-            if wvl not in profiles.wavelength.values:
-                continue
-            for animal in range(fl_imgs.animal.size):
-                prof = profiles.sel(wavelength=wvl, pair=pair).isel(animal=animal)
-                img = fl_imgs.sel(wavelength=wvl, pair=pair)[animal].astype(np.float)
-
-                # First, center according to mean
-                img = img - prof.mean()
+    n_positions = profiles.position.size
+    idx_to_clip = int(n_positions * percent_to_clip / 100)
+    profiles = profiles.isel(position=slice(idx_to_clip, n_positions - idx_to_clip))
+
+    # only normalize the wavelengths we have profiles for (i.e. skip TL). Profiles are
+    # matched to images by animal *index*, so give them the images' animal labels
+    wvls = [w for w in fl_imgs.wavelength.values if w in profiles.wavelength.values]
+    profiles = profiles.sel(wavelength=wvls).assign_coords(
+        animal=fl_imgs.animal.values
+    )
+    prof_mean = profiles.mean(dim="position")
+    prof_min = profiles.min(dim="position")
+    prof_max = profiles.max(dim="position")
 
-                # Then rescale to [0, 1]
-                img = (img - prof.min()) / (prof.max() - prof.min())
+    norm_fl = fl_imgs.astype(np.float64)
 
-                norm_fl.loc[dict(wavelength=wvl, pair=pair)][animal] = img
+    # First, center according to mean. Then rescale to [0, 1]
+    normed = (norm_fl.sel(wavelength=wvls) - prof_mean - prof_min) / (
+        prof_max - prof_min
+    )
+    norm_fl.loc[dict(wavelength=wvls)] = normed.transpose(*norm_fl.dims).values
 
     return norm_fl
 
@@ -785,27 +1025,43 @@ def z_normalize_with_masks(imgs, masks):
 
     [0] - https://jmotif.github.io/sax-vsm_site/morea/algorithm/znorm.html
     """
-    masked = ma.masked_array(imgs, np.logical_not(masks))
-    mu = np.mean(masked, axis=(-2, -1), keepdims=True)
-    sigma = np.std(masked, axis=(-2, -1), keepdims=True)
+    imgs = np.asarray(imgs)
+    masks = np.asarray(masks).astype(bool)
+
+    # mean/std of the masked pixels of each image. Images with empty masks come out
+    # as NaN
+    dtype = imgs.dtype if np.issubdtype(imgs.dtype, np.floating) else np.float64
+    n = np.sum(masks, axis=(-2, -1), keepdims=True).astype(dtype)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = np.sum(imgs, axis=(-2, -1), keepdims=True, where=masks) / n
+        sigma = np.sqrt(
+            np.sum((imgs - mu) ** 2, axis=(-2, -1), keepdims=True, where=masks) / n
+        )
 
-    return (imgs - mu) / sigma
+        return (imgs - mu) / sigma
 
 
 def create_normed_rgb_ratio_stack(
     r_imgs, seg_imgs, vmin=-7, vmax=7, cmap="coolwarm", output_filename=None
 ):
     """
-    Z-normalize the images (relative to the masks), then transform them into RGB with
-    the given colormap
+    Z-normalize the images (relative to the masks), then transform them into (8-bit)
+    RGB with the given colormap
     """
     r_znormed = z_normalize_with_masks(r_imgs, seg_imgs)
-    # noinspection PyUnresolvedReferences
-    normalizer = mpl.colors.Normalize(vmin=vmin, vmax=vmax)
     if isinstance(cmap, str):
         cmap = plt.get_cmap(cmap)
-    # TODO generalize dtype? for now, 32-bit only
-    rgb_img = cmap(normalizer(r_znormed))[:, :, :, :3].astype(np.float16)
+
+    # Index the colormap's (8-bit) lookup table directly instead of going through
+    # matplotlib's float64 path. The extra, last entry is the "bad" color, for NaNs
+    lut = np.concatenate(
+        [cmap(np.arange(cmap.N), bytes=True), cmap([np.nan], bytes=True)]
+    )[:, :3]
+    scaled = (r_znormed - vmin) * (cmap.N / (vmax - vmin))
+    with np.errstate(invalid="ignore"):
+        idx = np.clip(scaled, 0, cmap.N - 1).astype(np.min_scalar_type(cmap.N))
+    idx[np.isnan(scaled)] = cmap.N
+    rgb_img = lut[idx]
 
     if output_filename is not None:
         io.imsave(output_filename, rgb_img)
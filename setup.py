@@ -2,6 +2,62 @@
 PEP 517 doesn’t support editable installs
 so this file is currently here to support "pip install -e ."
 """
-from setuptools import setup
+import logging
+import os
 
-setup()
+from setuptools import Command, setup
+from setuptools.command.build_py import build_py
+
+UI_IO_PATHS = [
+    [
+        "pharedox/gui/qt_ui_files/*.ui",
+        "pharedox/gui/qt_py_files/%%FILENAME%%.py",
+    ]
+]
+
+
+class BuildUI(Command):
+    """Compile the Qt Designer .ui files into python modules (only if out of date)"""
+
+    description = "compile Qt .ui files to python with pyqt5ac"
+    user_options = [("force", "f", "recompile all .ui files, even if up to date")]
+    boolean_options = ["force"]
+
+    def initialize_options(self):
+        self.force = False
+
+    def finalize_options(self):
+        self.force = bool(self.force)
+
+    def run(self):
+        import pyqt5ac
+
+        pyqt5ac.main(ioPaths=UI_IO_PATHS, force=self.force)
+
+
+class BuildPy(build_py):
+    """
+    Package freshly compiled UI modules. They are compiled into the build directory,
+    so building never modifies the (committed) modules in the source tree
+    """
+
+    def run(self):
+        super().run()
+        try:
+            import pyqt5ac
+        except ImportError:
+            logging.warning(
+                "pyqt5ac not installed; packaging the committed qt_py_files as-is"
+            )
+            return
+
+        # always recompile: the copies just made in build_lib are newer than the .ui's
+        ui_files, py_file = UI_IO_PATHS[0]
+        pyqt5ac.main(
+            ioPaths=[[ui_files, os.path.join(self.build_lib, py_file)]],
+            force=True,
+            initPackage=False,
+        )
+
+
+setup(cmdclass={"build_ui": BuildUI, "build_py": BuildPy})
@@ -1,11 +1,53 @@
 import logging
 
+import matplotlib.pyplot as plt
+import numpy as np
 import pytest
+import xarray as xr
+from matplotlib.colors import Normalize
+from skimage import measure, transform
 
+from pharedox import image_processing as ip
 from pharedox import pio
 from pharedox import profile_processing as pp
 
 
+def segment_pharynx_per_frame(fl_img, target_area=450, area_range=100):
+    """
+    The original, frame-by-frame threshold search of `ip.segment_pharynx`, against
+    which the batched search is checked
+    """
+
+    def first_object_area(mask):
+        props = measure.regionprops(measure.label(mask))
+        return props[0].area if props else 0
+
+    min_area = target_area - area_range
+    max_area = target_area + area_range
+
+    p = 0.15
+    mask = fl_img > fl_img.max() * p
+    area = first_object_area(mask)
+
+    i = 0
+    while (min_area > area) or (area > max_area):
+        if i >= 300:
+            return mask
+        area = first_object_area(mask)
+        if area > max_area:
+            p = p + 0.01
+        if area < min_area:
+            p = p - 0.01
+        i = i + 1
+
+        mask = fl_img > fl_img.max() * p
+
+        if p < 0 or p > 0.9:
+            return fl_img > (fl_img.max() * 0.15)
+
+    return ip.extract_largest_binary_object(mask)
+
+
 class TestImageProcessing:
     @pytest.fixture(scope="function")
     def paired_imgs(self, shared_datadir):
@@ -35,4 +77,284 @@ def test_measure_under_labels(self):
         pass
 
     def test_subtract_medians(self):
-        pass
+        rng = np.random.default_rng(0)
+        imgs = xr.DataArray(
+            rng.integers(0, 1000, (3, 2, 3, 20, 30)).astype(np.uint16),
+            dims=["animal", "pair", "wavelength", "y", "x"],
+            coords={"wavelength": ["410", "470", "TL"]},
+        )
+        profiles = xr.DataArray(
+            rng.random((3, 2, 2, 50)) * 1000,
+            dims=["animal", "pair", "wavelength", "position"],
+            coords={"wavelength": ["410", "470"]},
+        )
+
+        submed = ip.subtract_medians(profiles, imgs)
+
+        medians = imgs.sel(wavelength=["410", "470"]).median(dim=["x", "y"])
+        expected = np.maximum(profiles.values - medians.values[..., np.newaxis], 0)
+        assert submed.dims == profiles.dims
+        assert np.allclose(submed.values, expected)
+
+    def test_segment_pharynxes(self, paired_imgs):
+        imgs = paired_imgs.isel(animal=slice(0, 6))
+
+        seg = ip.segment_pharynxes(imgs, wvl="410")
+
+        assert seg.dims == ("animal", "timepoint", "pair", "y", "x")
+        assert seg.dtype == np.uint8
+        for idx in np.ndindex(*seg.shape[:-2]):
+            expected = segment_pharynx_per_frame(imgs.sel(wavelength="410")[idx].values)
+            assert np.array_equal(seg[idx].values, expected)
+
+    def test_segment_pharynxes_search_exits(self, caplog):
+        yy, xx = np.mgrid[:60, :80]
+        blob = 1000 * np.exp(-(((xx - 40) / 20) ** 2 + ((yy - 30) / 8) ** 2))
+
+        # areas straddle the acceptable range at p=0.2, so the search oscillates until
+        # it runs out of iterations
+        oscillating = np.zeros((60, 80))
+        oscillating[10:40, 10:40] = 200
+        oscillating[20, 20] = 1000
+
+        # too small at any threshold (p < 0), too big at any threshold (p > 0.9)
+        too_small = np.zeros((60, 80))
+        too_small[30:33, 30:33] = 1000
+        too_big = np.full((60, 80), 1000.0)
+
+        frames = np.stack(
+            [
+                blob,
+                oscillating,
+                too_small,
+                too_big,
+                np.zeros((60, 80)),
+                np.roll(blob, 10, axis=1),
+            ]
+        )
+        imgs = xr.DataArray(
+            frames[:, np.newaxis, np.newaxis],
+            dims=["animal", "wavelength", "pair", "y", "x"],
+            coords={"wavelength": ["410"]},
+        )
+
+        with caplog.at_level(logging.WARNING):
+            seg = ip.segment_pharynxes(imgs, wvl="410")
+
+        assert "Caught infinite loop" in caplog.text
+        for i, frame in enumerate(frames):
+            expected = segment_pharynx_per_frame(frame)
+            assert np.array_equal(seg[i, 0].values, expected)
+        assert not np.any(seg[4].values)
+
+    def test_rotate_matches_two_pass_geometry(self):
+        # a smooth, elongated blob, off-center and tilted 30 degrees
+        rows, cols = 120, 160
+        y, x = np.mgrid[:rows, :cols]
+        theta = np.deg2rad(30)
+        u = (x - 60) * np.cos(theta) + (y - 50) * np.sin(theta)
+        v = -(x - 60) * np.sin(theta) + (y - 50) * np.cos(theta)
+        img = 1000 * np.exp(-np.square(u / 20) / 2 - np.square(v / 6) / 2)
+
+        props = measure.regionprops(measure.label(img > 100))[0]
+        center_y, center_x = props.centroid
+        tform = transform.EuclideanTransform(
+            translation=(-(cols / 2 - center_x), -(rows / 2 - center_y))
+        )
+
+        rotated = ip.rotate(img, tform, props.orientation)
+        # the translate-then-rotate implementation this replaced
+        expected = transform.rotate(
+            transform.warp(img, tform, mode="wrap", preserve_range=True, order=1),
+            np.degrees(np.pi / 2 - props.orientation),
+            mode="edge",
+            order=1,
+            preserve_range=True,
+        )
+
+        rot_props = measure.regionprops(measure.label(rotated > 100))[0]
+        exp_props = measure.regionprops(measure.label(expected > 100))[0]
+        np.testing.assert_allclose(rot_props.centroid, exp_props.centroid, atol=0.1)
+        np.testing.assert_allclose(
+            rot_props.orientation, exp_props.orientation, atol=0.01
+        )
+        np.testing.assert_allclose(
+            measure.centroid(rotated), measure.centroid(expected), atol=0.1
+        )
+
+    @pytest.fixture(scope="function")
+    def rotated_imgs(self, paired_imgs):
+        imgs = paired_imgs.isel(animal=slice(0, 6))
+        seg = ip.segment_pharynxes(imgs, wvl="410")
+        return ip.center_and_rotate_pharynxes(imgs, seg)
+
+    @pytest.mark.parametrize("thickness", [0, 3])
+    def test_measure_under_midlines(self, rotated_imgs, thickness):
+        rot_fl, rot_seg = rotated_imgs
+        rot_fl.attrs["foo"] = "bar"
+        midlines = ip.calculate_midlines(rot_seg)
+
+        profiles = ip.measure_under_midlines(
+            rot_fl, midlines, n_points=100, thickness=thickness
+        )
+
+        expected = xr.apply_ufunc(
+            ip.measure_under_midline,
+            rot_fl,
+            midlines,
+            input_core_dims=[["x", "y"], []],
+            output_core_dims=[["position"]],
+            vectorize=True,
+            keep_attrs=True,
+            kwargs={"n_points": 100, "thickness": thickness, "flatten": True},
+        )
+        assert profiles.dims == expected.dims
+        assert profiles.attrs == expected.attrs
+        # `position` is the only coordinate added on top of apply_ufunc's merge
+        xr.testing.assert_identical(
+            profiles.drop_vars("position").coords.to_dataset(),
+            expected.coords.to_dataset(),
+        )
+        assert np.allclose(profiles.values, expected.values, rtol=1e-5)
+
+    def test_measure_under_midlines_empty_mask(self, rotated_imgs):
+        rot_fl, rot_seg = rotated_imgs
+        rot_seg[0, 0, 0] = 0
+        midlines = ip.calculate_midlines(rot_seg)
+
+        profiles = ip.measure_under_midlines(rot_fl, midlines, n_points=100)
+
+        assert midlines[0, 0, 0].item() is None
+        assert np.all(profiles[0, 0, 0].values == 0)
+        assert not np.any(np.isnan(profiles.values))
+        assert np.all(profiles[1:].sel(wavelength="410").values > 0)
+
+    def test_measure_under_midline_coords_cache(self, rotated_imgs):
+        rot_fl, rot_seg = rotated_imgs
+        mid = ip.calculate_midlines(rot_seg).isel(animal=0).values.flat[0]
+        fl = rot_fl.isel(animal=0).transpose(..., "x", "y").values
+        fl = fl.reshape((-1,) + fl.shape[-2:])[0]
+        coords_cache = {}
+
+        for n_points, thickness in [(100, 0), (50, 0), (50, 3)]:
+            expected = ip.measure_under_midline(fl, mid, n_points, thickness)
+            cached = ip.measure_under_midline(
+                fl, mid, n_points, thickness, coords_cache=coords_cache
+            )
+            np.testing.assert_allclose(cached, expected)
+        assert len(coords_cache) == 3
+
+    def test_calculate_midlines(self, rotated_imgs):
+        _, rot_seg = rotated_imgs
+        rot_seg = rot_seg.copy()
+        # an empty frame (no midline) and one too narrow to determine a 4th degree fit
+        rot_seg[0, 0, 0] = 0
+        rot_seg[1, 0, 0] = 0
+        rot_seg[1, 0, 0, 60:70, 80:83] = 1
+
+        midlines = ip.calculate_midlines(rot_seg, degree=4)
+
+        assert midlines.dims == rot_seg.dims[:-2]
+        assert midlines[0, 0, 0].item() is None
+        xs = np.linspace(0, rot_seg.x.size - 1, 50)
+        for idx in np.ndindex(*midlines.shape):
+            expected = ip.calculate_midline(rot_seg[idx].values, degree=4)
+            mid = midlines[idx].item()
+            if expected is None:
+                assert mid is None
+                continue
+            assert np.array_equal(mid.domain, expected.domain)
+            assert np.allclose(mid(xs), expected(xs), atol=1e-6)
+
+    def test_z_normalize_with_masks(self):
+        rng = np.random.default_rng(0)
+        imgs = rng.normal(5, 2, (4, 20, 30))
+        masks = rng.random((4, 20, 30)) > 0.5
+        masks[2] = False  # an empty mask
+
+        z = ip.z_normalize_with_masks(imgs, masks)
+
+        masked = np.ma.masked_array(imgs, np.logical_not(masks))
+        mu = np.mean(masked, axis=(-2, -1), keepdims=True)
+        sigma = np.std(masked, axis=(-2, -1), keepdims=True)
+        expected = ((imgs - mu) / sigma).filled(np.nan)
+        assert np.all(np.isnan(z[2]))
+        np.testing.assert_allclose(z, expected, rtol=1e-10)
+
+    def test_create_normed_rgb_ratio_stack(self):
+        rng = np.random.default_rng(0)
+        imgs = rng.normal(1, 0.2, (3, 20, 30))
+        masks = np.zeros(imgs.shape, dtype=bool)
+        masks[:, 5:15, 5:25] = True
+        imgs[0, 0, :5] = np.nan  # outside of the mask, so only these pixels are NaN
+
+        # a narrow range, so plenty of pixels fall below/above it
+        rgb = ip.create_normed_rgb_ratio_stack(imgs, masks, vmin=-1, vmax=1)
+
+        z = ip.z_normalize_with_masks(imgs, masks)
+        expected = plt.get_cmap("coolwarm")(Normalize(-1, 1)(z), bytes=True)[..., :3]
+        assert rgb.dtype == np.uint8
+        assert np.any(z < -1) and np.any(z > 1)
+        np.testing.assert_array_equal(rgb, expected)
+
+    def test_normalize_images_by_wvl_pair(self):
+        rng = np.random.default_rng(0)
+        imgs = xr.DataArray(
+            rng.integers(0, 1000, (3, 2, 2, 3, 20, 30)).astype(np.uint16),
+            dims=["animal", "timepoint", "pair", "wavelength", "y", "x"],
+            coords={"wavelength": ["410", "470", "TL"], "animal": [0, 1, 2]},
+        )
+        # profiles are matched to the images by animal position, not label
+        profiles = xr.DataArray(
+            rng.random((3, 2, 2, 2, 100)) * 1000,
+            dims=["animal", "timepoint", "pair", "wavelength", "position"],
+            coords={"wavelength": ["410", "470"], "animal": [10, 11, 12]},
+        )
+
+        normed = ip.normalize_images_by_wvl_pair(imgs, profiles, percent_to_clip=5)
+
+        assert normed.dims == imgs.dims
+        np.testing.assert_array_equal(
+            normed.sel(wavelength="TL"), imgs.sel(wavelength="TL")
+        )
+        for a, tp, pair in np.ndindex(3, 2, 2):
+            for wvl in ["410", "470"]:
+                prof = profiles.sel(wavelength=wvl)[a, tp, pair].values[5:95]
+                img = imgs.sel(wavelength=wvl)[a, tp, pair].values.astype(np.float64)
+                expected = (img - prof.mean() - prof.min()) / (prof.max() - prof.min())
+                np.testing.assert_allclose(
+                    normed.sel(wavelength=wvl)[a, tp, pair], expected
+                )
+
+    def test_get_lr_bounds(self):
+        masks = np.zeros((3, 2, 1, 20, 40), dtype=np.uint8)
+        masks[0, :, :, 5:10, 8:30] = 1
+        # two objects: the bounds are those of the first (in raster order)
+        masks[1, :, :, 2:6, 20:35] = 1
+        masks[1, :, :, 10:15, 3:12] = 1
+        masks[2, :, :, 8:12, 0:40] = 1
+        rot_seg = xr.DataArray(
+            masks,
+            dims=["animal", "pair", "wavelength", "y", "x"],
+            coords={"wavelength": ["410"]},
+        )
+
+        bounds = ip.get_lr_bounds(rot_seg, pad=2)
+
+        expected = []
+        for mask in masks[:, 0, 0]:
+            _, l, _, r = measure.regionprops(measure.label(mask))[0].bbox
+            expected.append([l - 2, r + 2 - 1])
+        np.testing.assert_array_equal(bounds, expected)
+
+    def test_get_lr_bounds_empty_mask(self):
+        masks = np.zeros((2, 1, 1, 20, 40), dtype=np.uint8)
+        masks[0, :, :, 5:10, 8:30] = 1
+        rot_seg = xr.DataArray(
+            masks,
+            dims=["animal", "pair", "wavelength", "y", "x"],
+            coords={"wavelength": ["410"]},
+        )
+
+        with pytest.raises(ValueError):
+            ip.get_lr_bounds(rot_seg)